@@ -217,9 +217,16 @@ def categorical2transactions(x: np.ndarray) -> List[List[str]]:
     """
     assert len(x.shape) == 2
 
-    transactions = []
-    for entry in x:
-        transactions.append(['x%d=%d' % (i, val) for i, val in enumerate(entry)])
+    # Format the item string of each distinct (feature, category) pair only once,
+    # then build the whole (n_instances, n_features) item table by lookups and convert it in one go
+    columns = []
+    for i in range(x.shape[1]):
+        categories, inverse = np.unique(x[:, i], return_inverse=True)
+        items = np.array(['x%d=%d' % (i, val) for val in categories], dtype=object)
+        columns.append(items[inverse.reshape(-1)])
+    if len(columns) == 0:
+        return [[] for _ in range(x.shape[0])]
+    transactions = np.stack(columns, axis=1).tolist()
 
     return transactions
 
@@ -258,14 +265,32 @@ def rule_satisfied(x, features, categories) -> np.ndarray:
     :param categories: a list of categories
     :return:
     """
-    satisfied = []
     if features[0] == -1 and len(features) == 1:
         # Default rule, all satisfied
         return np.ones(x.shape[0], dtype=bool)
-    for idx, cat in zip(features, categories):
-        # Every single condition needs to be satisfied.
-        satisfied.append(x[:, idx] == cat)
-    return functools.reduce(np.logical_and, satisfied)
+    # Every single condition needs to be satisfied.
+    # Compare all the conditions at once and reduce them in a single C loop
+    satisfied = x[:, features] == np.asarray(categories)
+    return np.logical_and.reduce(satisfied, axis=1)
+
+
+def bits2lines(bits: np.ndarray) -> List[str]:
+    """
+    Format each row of a 2D bool array as a line of space separated 0s and 1s (ending with a newline).
+    The whole array is converted to characters at once instead of formatting the bits one by one.
+    :param bits: a 2D bool array of shape [n_rows, n_cols]
+    :return: a list of n_rows strings
+    """
+    n_rows, n_cols = bits.shape
+    if n_cols == 0:
+        return ['\n'] * n_rows
+    chars = np.full((n_rows, 2 * n_cols), ord(' '), dtype=np.uint8)
+    chars[:, 0::2] = bits
+    chars[:, 0::2] += ord('0')
+    chars[:, -1] = ord('\n')
+    text = chars.tobytes().decode('ascii')
+    line_len = 2 * n_cols
+    return [text[i:i + line_len] for i in range(0, len(text), line_len)]
 
 
 def categorical2pysbrl_data(x: np.ndarray, y: np.ndarray, data_name, supp=0.05, zmin=1, zmax=3):
@@ -276,38 +301,31 @@ def categorical2pysbrl_data(x: np.ndarray, y: np.ndarray, data_name, supp=0.05,
     labels = np.arange(np.max(labels) + 1)
     # assert max(labels) + 1 == len(labels)
 
-    x_by_labels = []
-    for label in labels:
-        x_by_labels.append(x[y == label])
-    transactions_by_labels = [categorical2transactions(_x) for _x in x_by_labels]
+    # Split the transactions rather than x, so that x is not copied once per label
+    transactions = categorical2transactions(x)
+    transactions_by_labels = [[transactions[i] for i in np.flatnonzero(y == label)] for label in labels]
     itemsets = transactions2freqitems(transactions_by_labels, supp=supp, zmin=zmin, zmax=zmax)
     rules = [itemset2feature_categories(itemset) for itemset in itemsets]
-    data_by_rule = []
-    for features, categories in rules:
-        satisfied = rule_satisfied(x, features, categories)
-        data_by_rule.append(satisfied)
+    data_by_rule = np.empty((len(rules), x.shape[0]), dtype=bool)
+    for i, (features, categories) in enumerate(rules):
+        data_by_rule[i] = rule_satisfied(x, features, categories)
 
     # Write data file
     data_filename = get_path(_datasets_path, data_name+'.data')
     before_save(data_filename)
     with open(data_filename, 'w') as f:
-        for itemset, data in zip(itemsets, data_by_rule):
+        for itemset, bit_s in zip(itemsets, bits2lines(data_by_rule)):
             rule_str = '{' + ','.join(itemset) + '}' + '  '
             f.write(rule_str)
-            bit_s = ' '.join(['1' if bit else '0' for bit in data])
             f.write(bit_s)
-            f.write('\n')
 
     # Write label file
     label_filename = get_path(_datasets_path, data_name+'.label')
     before_save(label_filename)
     with open(label_filename, 'w') as f:
-        for label in labels:
+        for label, bit_s in zip(labels, bits2lines(y == labels[:, None])):
             f.write('{label=%d} ' % label)
-            bits = y == label
-            bit_s = ' '.join(['1' if bit else '0' for bit in bits])
             f.write(bit_s)
-            f.write('\n')
     return data_filename, label_filename
 
 
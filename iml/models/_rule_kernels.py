@@ -0,0 +1,88 @@
+"""
+Compiled kernels for evaluating rule lists.
+numba is an optional dependency: when it is not installed, `eval_rulelist` and `eval_ruletrie` are None
+and the rule models fall back to their NumPy implementations.
+The kernels release the GIL, so that predictions made from several threads run concurrently.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    @njit(parallel=True, nogil=True, cache=True, boundscheck=False, error_model='numpy')
+    def eval_rulelist(x, features, cats, lens, first):
+        """
+        Evaluate a rule list in struct-of-arrays form, streaming over the instances in parallel
+        and stopping at the first rule that each instance satisfies.
+        :param x: the discretized instances, a 2D int array of shape [n_instances, n_features]
+        :param features: the feature indices of the conditions, a 2D int array of shape [n_rules, max_rule_len]
+        :param cats: the categories of the conditions, of the same shape as `features`
+        :param lens: the number of conditions of each rule, a 1D int array of shape [n_rules,]
+        :param first: the output, a 1D int array of shape [n_instances,] that is filled with the index
+            of the first satisfied rule of each instance, or n_rules if no rule is satisfied
+        """
+        n_rules = lens.shape[0]
+        for i in prange(x.shape[0]):
+            first[i] = n_rules
+            for k in range(n_rules):
+                satisfied = True
+                for l in range(lens[k]):
+                    if x[i, features[k, l]] != cats[k, l]:
+                        satisfied = False
+                        break
+                if satisfied:
+                    first[i] = k
+                    break
+
+    @njit(parallel=True, nogil=True, cache=True, boundscheck=False, error_model='numpy')
+    def eval_ruletrie(x, features, cats, rules, subtree_first, skips, root_rule, first):
+        """
+        Evaluate a rule list compiled into a condition trie flattened in preorder (see rule_model._build_trie),
+        so that the conditions shared by the prefixes of several rules are compared once per instance.
+        The subtrees that cannot hold a rule earlier than the best one found so far are skipped.
+        :param x: the discretized instances, a 2D int array of shape [n_instances, n_features]
+        :param features: the feature index of the condition of each node, a 1D int array of shape [n_nodes,]
+        :param cats: the category of the condition of each node, of the same shape as `features`
+        :param rules: the first rule that ends at each node, or n_rules if none
+        :param subtree_first: the first rule that ends in the subtree of each node
+        :param skips: the position following the subtree of each node
+        :param root_rule: the first rule without any condition, or n_rules if none
+        :param first: the output, a 1D int array of shape [n_instances,] that is filled with the index
+            of the first satisfied rule of each instance, or n_rules if no rule is satisfied
+        """
+        n_nodes = features.shape[0]
+        for i in prange(x.shape[0]):
+            best = root_rule
+            j = 0
+            while j < n_nodes:
+                if subtree_first[j] >= best or x[i, features[j]] != cats[j]:
+                    j = skips[j]
+                else:
+                    if rules[j] < best:
+                        best = rules[j]
+                    # descend to the first child, which follows the node in preorder
+                    j += 1
+            first[i] = best
+
+    def _warm_up():
+        """
+        Compile (or load from the disk cache) the kernels for the common compact dtypes on dummy inputs,
+        so that the first prediction does not pay for it
+        """
+        x = np.zeros((1, 1), dtype=np.uint8)
+        first = np.empty(1, dtype=np.intp)
+        features = np.zeros((1, 1), dtype=np.int16)
+        cats = np.zeros((1, 1), dtype=np.uint8)
+        eval_rulelist(x, features, cats, np.ones(1, dtype=np.int16), first)
+        nodes = np.zeros(1, dtype=np.int32)
+        eval_ruletrie(x, features[0], cats[0], nodes, nodes, np.ones(1, dtype=np.int32), 1, first)
+
+    _warm_up()
+else:
+    eval_rulelist = None
+    eval_ruletrie = None
@@ -130,8 +130,10 @@ class Classifier(ModelBase):
 
     def evaluate(self, x, y, stage='train'):
         acc = self.accuracy(y, self.predict(x))
-        loss = self.log_loss(y, self.predict_prob(x))
-        auc = auc_score(y, self.predict_prob(x), average='macro')
+        # Compute the probabilities once for both metrics
+        y_prob = self.predict_prob(x)
+        loss = self.log_loss(y, y_prob)
+        auc = auc_score(y, y_prob, average='macro')
         prefix = 'Training'
         if stage == 'test':
             prefix = 'Testing'
@@ -1,4 +1,5 @@
-from typing import List
+from typing import List, Optional, Tuple
+import hashlib
 
 import numpy as np
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
@@ -7,6 +8,23 @@ from iml.models import ModelBase
 from mdlp.discretization import MDLP
 
 
+# A cryptographic digest, so that two different arrays never share a fingerprint in practice
+# (blake2b is not available before Python 3.6)
+_digest = getattr(hashlib, 'blake2b', hashlib.sha256)
+
+
+def array_fingerprint(x) -> Optional[tuple]:
+    """
+    A fingerprint of the content of an array: its shape, dtype and a cryptographic digest of its bytes.
+    Used to recognize repeated calls on the same data, also when the array is modified in place between them.
+    :return: the fingerprint, or None for object arrays, whose content cannot be digested
+    """
+    x = np.ascontiguousarray(x)
+    if x.dtype.hasobject:
+        return None
+    return x.shape, x.dtype.str, _digest(x.data).digest()
+
+
 class PreProcessBase:
 
     def fit(self, x: np.ndarray, y: np.ndarray):
@@ -111,8 +129,16 @@ class DiscreteProcessor(PreProcessBase):
 class PreProcessMixin(ModelBase, PreProcessBase):
     def __init__(self, **kwargs):
         self.processors = []  # type: List[PreProcessBase]
+        # (fingerprint of x, transformed x) of the last call to _transform_x
+        self._transform_cache = None  # type: Optional[Tuple[tuple, np.ndarray]]
         super(PreProcessMixin, self).__init__(**kwargs)
 
+    def __getstate__(self):
+        getstate = getattr(super(PreProcessMixin, self), '__getstate__', None)
+        state = dict(self.__dict__ if getstate is None else getstate())
+        state['_transform_cache'] = None
+        return state
+
     def add_processor(self, processor: PreProcessBase):
         self.processors.append(processor)
 
@@ -122,6 +148,19 @@ class PreProcessMixin(ModelBase, PreProcessBase):
             _x, _y = processor.transform(_x, _y)
         return super(PreProcessMixin, self).transform(_x, _y)
 
+    def _transform_x(self, x):
+        """
+        Transform x only, reusing the result of the last call if it was made on the same data (see array_fingerprint),
+        so that back-to-back predictions on the same data only pay the transformation once.
+        """
+        key = array_fingerprint(x)
+        cache = getattr(self, '_transform_cache', None)
+        if key is not None and cache is not None and cache[0] == key:
+            return cache[1]
+        _x = self.transform(x)
+        self._transform_cache = None if key is None else (key, _x)
+        return _x
+
     def inverse_transform(self, y):
         _y = y
         for processor in reversed(self.processors):
@@ -129,11 +168,13 @@ class PreProcessMixin(ModelBase, PreProcessBase):
         return _y
 
     def fit(self, x: np.ndarray, y: np.ndarray=None):
+        self._transform_cache = None
         for processor in self.processors:
             processor.fit(x, y)
 
     def train(self, x, y, transform=True, **kwargs):
         # self.fit(x, y)
+        self._transform_cache = None
         if transform:
             self.fit(x, y)
             x, y = self.transform(x, y)
@@ -141,12 +182,12 @@ class PreProcessMixin(ModelBase, PreProcessBase):
 
     def predict_prob(self, x, transform=True, **kwargs):
         if transform:
-            x = self.transform(x)
+            x = self._transform_x(x)
         return super(PreProcessMixin, self).predict_prob(x, **kwargs)
 
     def predict(self, x, transform=True, **kwargs):
         if not transform:
             return super(PreProcessMixin, self).predict(x, **kwargs)
-        _x = self.transform(x)
+        _x = self._transform_x(x)
         _y = super(PreProcessMixin, self).predict(_x, **kwargs)
         return self.inverse_transform(_y)
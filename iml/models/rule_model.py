@@ -1,5 +1,7 @@
 from typing import Optional, Dict, List, Tuple, Union
-from functools import reduce
+from collections import defaultdict
+import re
+import threading
 import time
 
 import numpy as np
@@ -9,8 +11,9 @@ from mdlp.discretization import MDLP
 from pysbrl import train_sbrl
 
 from iml.models import Classifier, SurrogateMixin
-from iml.models.preprocess import PreProcessMixin, DiscreteProcessor
+from iml.models.preprocess import PreProcessMixin, DiscreteProcessor, array_fingerprint
 from iml.data_processing import categorical2pysbrl_data, get_discretizer
+from iml.models._rule_kernels import eval_rulelist, eval_ruletrie
 
 # numpy2ri.activate()
 #
@@ -27,14 +30,153 @@ from iml.data_processing import categorical2pysbrl_data, get_discretizer
 #     return DataFrame(_dict)
 
 
+# The number of uint64 words (64 instances each) processed at a time by the NumPy rule cascade,
+# small enough for the bitsets of a block to stay in the L1/L2 cache
+_BLOCK_WORDS = 2048
+
+# The maximum number of entries of the rule mask table of small rule lists, see _build_cube
+_CUBE_MAX_ENTRIES = 4096
+
+
+def _pack_bits(mask: np.ndarray) -> np.ndarray:
+    """
+    Pack a 1D bool array into a bitset of uint64 words, 64 instances per word (zero padded at the end)
+    """
+    packed = np.packbits(mask)
+    n_bytes = -(-len(packed) // 8) * 8
+    if n_bytes != len(packed):
+        packed = np.concatenate([packed, np.zeros(n_bytes - len(packed), dtype=np.uint8)])
+    return packed.view(np.uint64)
+
+
+def _unpack_bits(bits: np.ndarray, n: int) -> np.ndarray:
+    """
+    Unpack the first n bits of a bitset packed by _pack_bits into a uint8 array of 0s and 1s
+    """
+    return np.unpackbits(bits.view(np.uint8))[:n]
+
+
+def _build_trie(rule_conditions: List[List[Tuple[int, int]]], cat_dtype) -> Optional[tuple]:
+    """
+    Compile the rules into a trie of their (feature, category) conditions, so that the rules sharing
+    leading conditions share the nodes, and flatten it in preorder for eval_ruletrie.
+    The children of a node are ordered by the first rule in their subtree.
+    :param rule_conditions: the conditions of each rule, in evaluation order
+    :param cat_dtype: the dtype of the categories
+    :return: a tuple (features, cats, rules, subtree_first, skips, root_rule) of the arguments of eval_ruletrie,
+        or None if the trie does not have fewer nodes than the rules have conditions
+    """
+    n_rules = len(rule_conditions)
+    root_rule = n_rules
+    root = {}  # condition -> [the first rule ending at the node, children, the first rule in the subtree]
+    for k, conditions in enumerate(rule_conditions):
+        if len(conditions) == 0:
+            root_rule = min(root_rule, k)
+            continue
+        children = root
+        node = None
+        for condition in sorted(conditions):
+            node = children.setdefault(condition, [n_rules, {}, n_rules])
+            children = node[1]
+        node[0] = min(node[0], k)
+
+    def subtree_first(node):
+        node[2] = min([node[0]] + [subtree_first(child) for child in node[1].values()])
+        return node[2]
+
+    for node in root.values():
+        subtree_first(node)
+
+    nodes = []  # (feature, category, rule, subtree_first, skip) in preorder
+
+    def flatten(children):
+        for condition, node in sorted(children.items(), key=lambda item: item[1][2]):
+            position = len(nodes)
+            nodes.append(None)
+            flatten(node[1])
+            nodes[position] = condition + (node[0], node[2], len(nodes))
+
+    flatten(root)
+    if len(nodes) >= sum(len(conditions) for conditions in rule_conditions):
+        return None
+    nodes = np.array(nodes, dtype=np.int).reshape(-1, 5)
+    return (nodes[:, 0].astype(np.int16), nodes[:, 1].astype(cat_dtype), nodes[:, 2].astype(np.int32),
+            nodes[:, 3].astype(np.int32), nodes[:, 4].astype(np.int32), root_rule)
+
+
+def _build_cube(rule_conditions: List[List[Tuple[int, int]]], features: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Materialize the conditions of a small rule list as a (n_used_features, n_categories + 1) table of uint64 rule masks,
+    where bit k of entry [j, c] is set iff rule k holds when its used feature j takes category c
+    (always the case if rule k has no condition on feature j).
+    The last column holds the masks for the categories that no rule mentions.
+    :param rule_conditions: the conditions of each rule, in evaluation order
+    :param features: the features used by the conditions
+    :return: the mask table, or None if there are more than 64 rules or the table would have more than _CUBE_MAX_ENTRIES entries
+    """
+    n_rules = len(rule_conditions)
+    if n_rules == 0 or n_rules > 64:
+        return None
+    categories = [category for conditions in rule_conditions for _, category in conditions]
+    if min(categories, default=0) < 0:
+        return None
+    n_categories = max(categories, default=-1) + 1
+    if len(features) * (n_categories + 1) > _CUBE_MAX_ENTRIES:
+        return None
+    table = np.zeros((len(features), n_categories + 1), dtype=np.uint64)
+    for k, conditions in enumerate(rule_conditions):
+        bit = np.uint64(1 << k)
+        required = defaultdict(set)  # feature -> the categories required by the rule
+        for feature, category in conditions:
+            required[feature].add(category)
+        for j, feature in enumerate(features):
+            if feature not in required:
+                table[j] |= bit
+            elif len(required[feature]) == 1:
+                table[j, next(iter(required[feature]))] |= bit
+    return table
+
+
 class Rule:
     def __init__(self, feature_indices: List[int], categories: List[int],
                  output: Union[List, np.ndarray], support: Union[List, np.ndarray] = None):
+        self._idx = None  # type: np.ndarray
+        self._cat = None  # type: np.ndarray
         self.feature_indices = feature_indices
         self.categories = categories
         self.output = output  # The probability distribution
         self.support = support
 
+    @property
+    def feature_indices(self) -> List[int]:
+        return self._feature_indices
+
+    @feature_indices.setter
+    def feature_indices(self, feature_indices: List[int]):
+        self._feature_indices = feature_indices
+        # Cached as an index array so that is_satisfy gathers all the columns at once
+        self._idx = np.asarray(feature_indices, dtype=np.intp)
+
+    @property
+    def categories(self) -> List[int]:
+        return self._categories
+
+    @categories.setter
+    def categories(self, categories: List[int]):
+        self._categories = categories
+        self._cat = np.asarray(categories)
+
+    def __setstate__(self, state):
+        # Rules pickled before the cached index arrays hold plain feature_indices / categories attributes
+        state = dict(state)
+        feature_indices = state.pop('feature_indices', None)
+        categories = state.pop('categories', None)
+        self.__dict__.update(state)
+        if feature_indices is not None:
+            self.feature_indices = feature_indices
+        if categories is not None:
+            self.categories = categories
+
     def is_default(self):
         return len(self.feature_indices) == 0
 
@@ -56,54 +198,89 @@ class Rule:
                 _feature_names = ["X" + str(idx) for idx in self.feature_indices]
             else:
                 _feature_names = [feature_names[idx] for idx in self.feature_indices]
-            # if category_intervals is None:
-            #     categories = [" = " + str(category) for category in self.categories]
-            # else:
-            categories = []
-            for interval, cat in zip(category_intervals, self.categories):
+            if category_intervals is None:
+                category_intervals = [None] * len(self.categories)
+            conditions = []
+            for feature, interval, cat in zip(_feature_names, category_intervals, self.categories):
                 if interval is None:
-                    categories.append(" = " + str(cat))
+                    conditions.append("({} = {})".format(feature, cat))
                 elif len(interval) == 2:
-                    categories.append(" in " + str(interval))
+                    conditions.append("({} in {})".format(feature, interval))
                 else:
                     raise ValueError("interval must be a [number, number] or None")
-
-            s = "IF "
-            # conditions
-            conditions = ["({}{})".format(feature, category) for feature, category in zip(_feature_names, categories)]
-            s += " and ".join(conditions)
-            # results
-            s += " THEN " + output
+            s = "IF {} THEN {}".format(" and ".join(conditions), output)
 
         if self.support is not None:
-            support = [("+" if i == pred_label else "-") + str(support) for i, support in enumerate(self.support)]
-            s += " [" + "/".join(support) + "]"
+            support = "/".join([("+" if i == pred_label else "-") + str(support)
+                                for i, support in enumerate(self.support)])
+            s = "{} [{}]".format(s, support)
         return s
 
-    def is_satisfy(self, x_cat) -> Union[np.ndarray, List[np.ndarray]]:
-        satisfied = []
+    def is_exclusive(self, other) -> bool:
+        """
+        Whether the two rules can never be satisfied by the same instance,
+        i.e., they require different categories of a same feature
+        """
+        conditions = dict(zip(self.feature_indices, self.categories))
+        for idx, cat in zip(other.feature_indices, other.categories):
+            if idx in conditions and conditions[idx] != cat:
+                return True
+        return False
+
+    def is_satisfy(self, x_cat, out=None) -> np.ndarray:
+        """
+        Whether each instance satisfies the rule
+        :param x_cat: the discretized instances, a 2D array of shape [n_instances, n_features]
+        :param out: an optional bool array of shape [n_instances,] to write the result into,
+            so that callers evaluating many rules can reuse one buffer
+        :return: a bool array of shape [n_instances,]
+        """
         if self.is_default():
-            return np.ones(x_cat.shape[0], dtype=bool)
-        for idx, cat in zip(self.feature_indices, self.categories):
-            satisfied.append(x_cat[:, idx] == cat)
-        # if per_condition:
-        #     return satisfied
-        return reduce(np.logical_and, satisfied)
+            if out is None:
+                return np.ones(x_cat.shape[0], dtype=bool)
+            out.fill(True)
+            return out
+        # One gather + one comparison against the broadcast category row, then a single reduction
+        return np.all(x_cat[:, self._idx] == self._cat, axis=1, out=out)
 
 
-def rule_name2rule(rule_name, prob, support=None):
-    if rule_name == 'default':
-        return Rule([], [], prob, support)
-
-    raw_rules = rule_name[1:-1].split(',')
-    feature_indices = []
-    categories = []
-    for raw_rule in raw_rules:
-        idx = raw_rule.find('=')
-        if idx == -1:
+# The conditions of a rule name, e.g. 'X1=2' in '{X1=2,X3=0}'
+_RULE_RE = re.compile(r'(\d+)=(-?\d+)')
+
+
+def parse_rule_names(rule_names: List[str]) -> List[Tuple[List[int], List[int]]]:
+    """
+    Parse the rule names returned by sbrl, e.g. '{X1=2,X3=0}' or 'default', into their feature indices and categories.
+    All the names are scanned with a single regex pass over the joined names.
+    :return: a list of (feature_indices, categories) tuples, one for each rule name
+    """
+    n_conditions = []
+    for rule_name in rule_names:
+        n = rule_name.count('=')
+        if n == 0 and rule_name != 'default':
             raise ValueError("No '=' find in the rule!")
-        feature_indices.append(int(raw_rule[1:idx]))
-        categories.append(int(raw_rule[(idx + 1):]))
+        n_conditions.append(n)
+    conditions = np.array(_RULE_RE.findall(';'.join(rule_names)), dtype=np.int).reshape(-1, 2)
+    if len(conditions) != sum(n_conditions):
+        raise ValueError("Unable to parse the rules: {}".format(rule_names))
+    features, categories = conditions[:, 0].tolist(), conditions[:, 1].tolist()
+    parsed = []
+    start = 0
+    for n in n_conditions:
+        parsed.append((features[start:start + n], categories[start:start + n]))
+        start += n
+    return parsed
+
+
+def parse_rule_name(rule_name) -> Tuple[List[int], List[int]]:
+    """
+    Parse a rule name returned by sbrl, e.g. '{X1=2,X3=0}', into its feature indices and categories
+    """
+    return parse_rule_names([rule_name])[0]
+
+
+def rule_name2rule(rule_name, prob, support=None):
+    feature_indices, categories = parse_rule_name(rule_name)
     return Rule(feature_indices, categories, prob, support=support)
 
 
@@ -132,13 +309,54 @@ class SBRL(Classifier):
         self._rule_indices = None  # type: Optional[np.ndarray]
         self._rule_probs = None  # type: Optional[np.ndarray]
         self._rule_names = None
+        self._parsed_rules = None  # type: Optional[Dict[int, Tuple[List[int], List[int]]]]
         self._rule_list = []  # type: List[Rule]
         self._n_classes = None
         self._n_features = None
 
+        # Struct-of-arrays form of self._rule_list built by _compile_rules, used for evaluating the rules.
+        # self._rule_list itself is kept for describing the rules.
+        self._rule_features = None  # type: Optional[np.ndarray]
+        self._rule_cats = None  # type: Optional[np.ndarray]
+        self._rule_len = None  # type: Optional[np.ndarray]
+        self._rule_outputs = None  # type: Optional[np.ndarray]
+        # The predicted label of each rule, followed by label 0 for the instances that satisfy no rule
+        self._rule_labels = None  # type: Optional[np.ndarray]
+        # The (feature, category) conditions of each rule in the evaluation order of the tables
+        self._rule_conditions = None  # type: Optional[List[List[Tuple[int, int]]]]
+        # The rule index of each position in the evaluation order of the tables, None if unchanged
+        self._rule_order = None  # type: Optional[np.ndarray]
+        # The flattened condition trie of the tables (see _build_trie), None if the rules share no prefixes
+        self._rule_trie = None  # type: Optional[tuple]
+        # The rule mask table of small rule lists (see _build_cube), otherwise None
+        self._rule_cube = None  # type: Optional[np.ndarray]
+        # The sorted features used by the conditions of the rules
+        self._used_features = None  # type: Optional[np.ndarray]
+        # Per-thread scratch buffers reused across prediction calls, see _scratch_buffer
+        self._scratch = threading.local()
+
         # if discretizer is not None:
         #     self.add_processor(DiscreteProcessor(discretizer))
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The scratch buffers are not picklable, nor worth saving
+        state.pop('_scratch', None)
+        return state
+
+    def __setstate__(self, state):
+        # Models pickled before the compiled tables lack the attributes below
+        defaults = dict.fromkeys(['_parsed_rules', '_rule_features', '_rule_cats', '_rule_len', '_rule_outputs',
+                                  '_rule_labels', '_rule_conditions', '_rule_order', '_rule_trie', '_rule_cube',
+                                  '_used_features'])
+        defaults.update(state)
+        self.__dict__.update(defaults)
+        self._scratch = threading.local()
+        if self._parsed_rules is None and self._rule_names is not None and self._rule_indices is not None:
+            self._parse_rule_names()
+        if self._rule_outputs is None and self._rule_probs is not None:
+            self._compile_rules()
+
     @property
     def rule_list(self):
         return self._rule_list
@@ -200,6 +418,7 @@ class SBRL(Classifier):
         self._rule_indices = _model[0]
         self._rule_probs = _model[1]
         self._rule_names = _model[2]
+        self._parse_rule_names()
 
         # def post_process():
         #     self._rule_list = []
@@ -212,6 +431,14 @@ class SBRL(Classifier):
 
         self.post_process(x, y)
 
+    def _parse_rule_names(self):
+        """
+        Parse the names of the rules in the rule list once after training,
+        so that (re-)building the rule list in post_process does not parse strings again
+        """
+        parsed = parse_rule_names([self._rule_names[idx] for idx in self._rule_indices])
+        self._parsed_rules = dict(zip(self._rule_indices, parsed))
+
     def post_process(self, x, y):
         """
         Post process function that clean the extracted rules
@@ -220,11 +447,15 @@ class SBRL(Classifier):
         # trim_threshold = 0.0005 * len(y)
         self._rule_list = []
         for i, idx in enumerate(self._rule_indices):
-            _rule_name = self._rule_names[idx]
-            self._rule_list.append(rule_name2rule(_rule_name, self._rule_probs[i]))
+            feature_indices, categories = self._parsed_rules[idx]
+            # Copy the lists since RuleList.post_process may trim the conditions of the rule
+            self._rule_list.append(Rule(list(feature_indices), list(categories), self._rule_probs[i]))
+        self._compile_rules()
         support_summary = self.compute_support(x, y)
         for rule, support in zip(self._rule_list, support_summary):
             rule.support = support
+        # Recompile to evaluate the rules in the order of their supports
+        self._compile_rules()
         # to_be_kept = [np.sum(rule.support) > trim_threshold for rule in self.rule_list]
         # n_trimed = len(self.rule_list) - np.sum(to_be_kept)
         # print("Trimmed {} rules".format(n_trimed))
@@ -232,6 +463,239 @@ class SBRL(Classifier):
         # self._rule_probs = self._rule_probs[to_be_kept]
         # self.post_process(x, y)
 
+    def _compile_rules(self):
+        """
+        Build the struct-of-arrays form of the rule list: contiguous (n_rules, max_rule_len) tables
+        of the condition features and categories, the length of each rule and the outputs.
+        Shorter rules are padded by repeating their first condition, which leaves their result unchanged.
+        The tables are laid out in the evaluation order given by _evaluation_order.
+        A trailing rule without conditions (the default rule) is left out of the condition tables:
+        the instances that satisfy none of the evaluated rules get its position, n_evaluated, directly.
+        Needs to be called whenever self._rule_list is modified.
+        """
+        n_rules = self.n_rules
+        order = self._evaluation_order()
+        rules = [self._rule_list[r] for r in order]
+        self._rule_order = None if np.array_equal(order, np.arange(n_rules)) else np.append(order, n_rules)
+        if n_rules > 0 and rules[-1].is_default():
+            rules = rules[:-1]
+        n_evaluated = len(rules)
+        self._rule_len = np.array([len(rule.feature_indices) for rule in rules], dtype=np.int16)
+        self._rule_conditions = [list(zip(rule.feature_indices, rule.categories)) for rule in rules]
+        max_len = max(int(np.max(self._rule_len)) if n_evaluated else 0, 1)
+        assert self.n_features is None or self.n_features <= np.iinfo(np.int16).max
+        categories = [cat for rule in rules for cat in rule.categories]
+        # The smallest integer dtype holding all the categories: uint8 for the usual non-negative categories
+        # below 256, falling back to (u)int16 and signed types when needed
+        cat_min, cat_max = min(categories, default=0), max(categories, default=0)
+        cat_dtype = np.promote_types(np.min_scalar_type(cat_min), np.min_scalar_type(cat_max))
+        assert cat_dtype.itemsize <= 2
+        self._rule_features = np.zeros((n_evaluated, max_len), dtype=np.int16)
+        self._rule_cats = np.zeros((n_evaluated, max_len), dtype=cat_dtype)
+        # The extra all-zero row is the output of the instances that satisfy no rule.
+        # float32 is precise enough for the predicted probabilities and halves the size of the gathered rows
+        self._rule_outputs = np.zeros((n_rules + 1, self._rule_probs.shape[1]), dtype=np.float32)
+        for i, rule in enumerate(rules):
+            rule_len = self._rule_len[i]
+            if rule_len > 0:
+                self._rule_features[i] = rule.feature_indices[0]
+                self._rule_cats[i] = rule.categories[0]
+                self._rule_features[i, :rule_len] = rule.feature_indices
+                self._rule_cats[i, :rule_len] = rule.categories
+        # The outputs stay indexed by the rule index
+        for i, rule in enumerate(self._rule_list):
+            self._rule_outputs[i] = rule.output
+        # The labels are taken from the float64 outputs, as Rule.describe does, so that near ties agree with it.
+        # The instances that satisfy no rule get label 0
+        self._rule_labels = np.zeros(n_rules + 1, dtype=np.intp)
+        for i, rule in enumerate(self._rule_list):
+            self._rule_labels[i] = np.argmax(rule.output)
+        self._rule_trie = _build_trie(self._rule_conditions, cat_dtype)
+        self._used_features = np.array(sorted({feature for conditions in self._rule_conditions
+                                               for feature, _ in conditions}), dtype=np.intp)
+        self._rule_cube = _build_cube(self._rule_conditions, self._used_features)
+
+    def _evaluation_order(self) -> np.ndarray:
+        """
+        Compute the order in which the rules are evaluated, so that the rules with larger supports
+        are tried first and most instances stop early in the cascade.
+        A rule is only moved ahead of the rules that it is exclusive with,
+        so that the first satisfied rule of any instance stays the same.
+        :return: an int array of the rule indices in evaluation order
+        """
+        order = list(range(self.n_rules))
+        if any(rule.support is None for rule in self._rule_list):
+            return np.array(order, dtype=np.intp)
+        supports = [np.sum(rule.support) for rule in self._rule_list]
+        # Insertion sort by descending support that only swaps neighbouring exclusive rules
+        for i in range(1, len(order)):
+            j = i
+            while j > 0 and supports[order[j]] > supports[order[j - 1]] \
+                    and self._rule_list[order[j]].is_exclusive(self._rule_list[order[j - 1]]):
+                order[j - 1], order[j] = order[j], order[j - 1]
+                j -= 1
+        return np.array(order, dtype=np.intp)
+
+    def _compact(self, x, order='C') -> np.ndarray:
+        """
+        Cast the discretized x to the compact integer dtype of the rule categories (typically uint8),
+        so that the condition comparisons touch 1 or 2 bytes per value instead of 8.
+        :param x: x should be already transformed
+        :param order: the memory layout of the result, 'C' or 'F'
+        :return: the cast x, or x itself (in the given layout) if it holds values
+            that cannot be represented by the compact dtype
+        """
+        x = np.asarray(x, order=order)
+        dtype = self._rule_cats.dtype
+        if x.dtype == dtype or x.size == 0:
+            return x
+        info = np.iinfo(dtype)
+        if np.min(x) < info.min or np.max(x) > info.max:
+            # Unseen large categories would wrap around and match the wrong rules
+            return x
+        _x = np.asarray(x, dtype=dtype, order=order)
+        if x.dtype.kind == 'f' and not np.array_equal(_x, x):
+            return x
+        return _x
+
+    def _assign_rule(self, x) -> np.ndarray:
+        """
+        Find the first rule that each instance satisfies
+        :param x: x should be already transformed
+        :return: an int array of shape [n_instances,], the index of the first satisfied rule of each instance,
+            or n_rules if the instance satisfies none of the rules
+        """
+        x = np.asarray(x)
+        # The compiled kernels do not check bounds, so reject inputs lacking any feature used by the rules
+        if x.ndim != 2:
+            raise ValueError("x should be a 2D array, got an array of shape {}".format(x.shape))
+        if len(self._used_features) and x.shape[1] <= self._used_features[-1]:
+            raise IndexError("index {} is out of bounds for axis 1 with size {}".format(
+                self._used_features[-1], x.shape[1]))
+        winner = self._scratch_buffer('winner', x.shape[0], np.intp)
+        if eval_rulelist is not None:
+            # The kernels walk the instances row by row
+            x = self._compact(x, order='C')
+            if self._rule_trie is not None:
+                eval_ruletrie(x, *self._rule_trie, winner)
+            else:
+                eval_rulelist(x, self._rule_features, self._rule_cats, self._rule_len, winner)
+        elif self._rule_cube is None or not self._numpy_cube(x, winner):
+            self._numpy_cascade(self._column_index(x), x.shape[0], winner)
+        if self._rule_order is not None:
+            # map the positions in the evaluation order back to the rule indices
+            np.take(self._rule_order, winner, out=winner)
+        return winner
+
+    def _scratch_buffer(self, name, n, dtype, width=None) -> np.ndarray:
+        """
+        Get the scratch buffer of the given name for n instances (n rows of the given width if width is not None).
+        The buffers are kept per thread and only grown when a larger n (or another width) is seen,
+        so repeated predictions do not allocate them again.
+        The returned view is overwritten by the next prediction call of the same thread.
+        """
+        shape = (n,) if width is None else (n, width)
+        buffer = getattr(self._scratch, name, None)
+        if buffer is None or len(buffer) < n or buffer.shape[1:] != shape[1:] or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            setattr(self._scratch, name, buffer)
+        return buffer[:n]
+
+    def _column_index(self, x) -> Dict[Tuple[int, int], np.ndarray]:
+        """
+        Build the inverted index from each distinct (feature, category) condition of the rules
+        to the bitset (see _pack_bits) of the instances in x that satisfy it.
+        The index of the last x is kept (per thread), keyed by the digest fingerprint of its used columns
+        (see array_fingerprint), so that the index is only reused for the same data and the calls following
+        each other on it (e.g., predict_prob, decision_support and compute_support) compare each condition only once.
+        :param x: x should be already transformed
+        """
+        columns = self._feature_columns(x)
+        key = array_fingerprint(columns)
+        cached = getattr(self._scratch, 'column_index', None)
+        if key is not None and cached is not None and cached[0] == key and cached[1] is self._rule_conditions:
+            return cached[2]
+        positions = {feature: j for j, feature in enumerate(self._used_features)}
+        index = {}
+        for conditions in self._rule_conditions:
+            for condition in conditions:
+                if condition not in index:
+                    feature, category = condition
+                    index[condition] = _pack_bits(columns[positions[feature]] == category)
+        self._scratch.column_index = (key, self._rule_conditions, index)
+        return index
+
+    def _feature_columns(self, x) -> np.ndarray:
+        """
+        Gather the columns of the features used by the rules (self._used_features) as the contiguous rows
+        of a (n_used_features, n_instances) array in the compact dtype (see _compact),
+        so that NumPy compares dense vectors and the unused features are never converted.
+        :param x: x should be already transformed
+        """
+        # Indexing the transposed x along its first axis returns each gathered column as a C-contiguous row
+        return self._compact(np.asarray(x).T[self._used_features])
+
+    def _numpy_cube(self, x, winner) -> bool:
+        """
+        The NumPy implementation of the rule list for small rule lists, using the rule mask table of _build_cube.
+        Each instance ANDs the rule masks of its category on every used feature, one gather per used feature,
+        and the lowest set bit of the result is the first rule it satisfies.
+        :param x: x should be already transformed
+        :param winner: the output array, filled with the position of the first satisfied rule
+            of each instance in the tables, or the number of rules in the tables
+        :return: False if x holds non-integral values and the cube cannot be used, otherwise True
+        """
+        columns = self._feature_columns(x)
+        if columns.dtype.kind == 'f':
+            return False
+        table = self._rule_cube
+        n_categories = table.shape[1] - 1
+        masks = self._scratch_buffer('masks', x.shape[0], np.uint64)
+        masks.fill(~np.uint64(0))
+        for j, column in enumerate(columns):
+            # the categories that no rule mentions share the last column
+            column = np.where((0 <= column) & (column < n_categories), column, n_categories)
+            masks &= table[j][column]
+        # isolate the lowest set bit, whose log2 is the position of the first satisfied rule
+        masks &= ~masks + np.uint64(1)
+        winner.fill(len(self._rule_conditions))
+        matched = np.flatnonzero(masks)
+        winner[matched] = np.log2(masks[matched]).astype(np.intp)
+        return True
+
+    def _numpy_cascade(self, column_index, n, winner):
+        """
+        The NumPy implementation of the rule cascade over the compiled tables.
+        The instance masks are kept as bitsets of uint64 words, so that combining conditions and
+        tracking the unmatched instances take one bitwise operation per 64 instances.
+        The instances are processed in blocks of _BLOCK_WORDS words, walking all the rules within a block
+        before moving on, so that the bitsets touched by the cascade stay in cache.
+        :param column_index: the condition bitsets of the instances, see _column_index
+        :param n: the number of instances
+        :param winner: the output array, filled with the position of the first satisfied rule
+            of each instance in the tables, or the number of rules in the tables
+        """
+        winner.fill(len(self._rule_conditions))
+        # The instances that satisfy none of the rules evaluated so far
+        remaining = _pack_bits(np.ones(n, dtype=bool))
+        satisfied = np.empty(min(len(remaining), _BLOCK_WORDS), dtype=np.uint64)
+        for start in range(0, len(remaining), _BLOCK_WORDS):
+            stop = min(start + _BLOCK_WORDS, len(remaining))
+            block_remaining = remaining[start:stop]
+            block_satisfied = satisfied[:stop - start]
+            block_winner = winner[start * 64:stop * 64]
+            for k, conditions in enumerate(self._rule_conditions):
+                block_satisfied[:] = block_remaining
+                for condition in conditions:
+                    block_satisfied &= column_index[condition][start:stop]
+                if not block_satisfied.any():
+                    continue
+                block_winner[np.flatnonzero(_unpack_bits(block_satisfied, len(block_winner)))] = k
+                block_remaining &= ~block_satisfied
+                # stop as soon as every instance of the block has found its rule
+                if not block_remaining.any():
+                    break
+
     def compute_support(self, x, y) -> np.ndarray:
         """
         Calculate the support for the rules
@@ -241,21 +705,40 @@ class SBRL(Classifier):
         """
         n_classes = self.n_classes
         n_rules = self.n_rules
-        supports = self.decision_support(x)
-        if np.sum(supports.astype(np.int)) != x.shape[0]:
-            print(np.sum(supports.astype(np.int)))
+        winner = self._assign_rule(x)
+        # There may occur labels that have not seen in training
+        n_labels = max(n_classes, int(np.max(y)) + 1) if len(y) else n_classes
+        # Count the (rule, label) pairs of all the instances in one histogram,
+        # the instances that satisfy no rule fall into the extra last row
+        pairs = winner * n_labels + y.astype(np.intp)
+        support_summary = np.bincount(pairs, minlength=(n_rules + 1) * n_labels).reshape(n_rules + 1, n_labels)
+        # The number of unsupported instances comes from the histogram, without another pass over winner
+        n_supported = x.shape[0] - int(np.sum(support_summary[n_rules]))
+        if n_supported != x.shape[0]:
+            print(n_supported)
             print(x.shape[0])
-            print(supports)
-        support_summary = np.zeros((n_rules, n_classes), dtype=np.int)
-        for i, support in enumerate(supports):
-            support_labels = y[support]
-            unique_labels, unique_counts = np.unique(support_labels, return_counts=True)
-            if len(unique_labels) > 0 and np.max(unique_labels) > support_summary.shape[1]:
-                # There occurs labels that have not seen in training
-                pad_len = np.max(unique_labels) - support_summary.shape[1]
-                support_summary = np.hstack((support_summary, np.zeros((n_rules, pad_len), dtype=np.int)))
-            support_summary[i, unique_labels] = unique_counts
-        return support_summary
+            print(winner)
+        return support_summary[:n_rules].astype(np.int)
+
+    def compute_confusion_support(self, x, y, y_target) -> np.ndarray:
+        """
+        Calculate the confusion matrix of y against y_target on the instances supported by each rule
+        :param x: x should be already transformed
+        :param y: the true labels
+        :param y_target: the labels predicted by the target model
+        :return: an int array of shape [n_rules, n_classes, n_classes], where entry [r, i, j] counts
+            the instances of rule r labeled i and predicted as j (the labels outside the classes are ignored)
+        """
+        n_classes = self.n_classes
+        n_rules = self.n_rules
+        winner = self._assign_rule(x)
+        y, y_target = np.asarray(y, dtype=np.intp), np.asarray(y_target, dtype=np.intp)
+        valid = (0 <= y) & (y < n_classes) & (0 <= y_target) & (y_target < n_classes)
+        # Count the (rule, label, target label) triples of all the instances in one histogram,
+        # the instances that satisfy no rule fall into the extra last rule
+        triples = (winner[valid] * n_classes + y[valid]) * n_classes + y_target[valid]
+        counts = np.bincount(triples, minlength=(n_rules + 1) * n_classes * n_classes)
+        return counts.reshape(n_rules + 1, n_classes, n_classes)[:n_rules]
 
     def evaluate(self, x, y, stage='train') -> Tuple[float, float]:
         y_prob = self.predict_prob(x)
@@ -279,19 +762,11 @@ class SBRL(Classifier):
         :return:
             return a list of n_rules np.ndarray of shape [n_instances,] of type bool
         """
-        un_satisfied = np.ones((x.shape[0],), dtype=np.bool)
-        supports = np.zeros((self.n_rules, x.shape[0]), dtype=np.bool)
-        for i, rule in enumerate(self._rule_list):
-            is_satisfied = rule.is_satisfy(x)
-            # if per_condition:
-            #     is_satisfied = [np.logical_and(_satisfied, un_satisfied) for _satisfied in is_satisfied]
-            #     satisfied = reduce(np.logical_and, is_satisfied)
-            # else:
-            satisfied = np.logical_and(is_satisfied, un_satisfied)
-            # satisfied = is_satisfied
-            # marking new satisfied instances as satisfied
-            un_satisfied = np.logical_xor(satisfied, un_satisfied)
-            supports[i, :] = satisfied
+        winner = self._assign_rule(x)
+        # if per_condition:
+        #     is_satisfied = [np.logical_and(_satisfied, un_satisfied) for _satisfied in is_satisfied]
+        #     satisfied = reduce(np.logical_and, is_satisfied)
+        supports = winner == np.arange(self.n_rules)[:, None]
         return supports
 
     def decision_path(self, x) -> np.ndarray:
@@ -302,43 +777,49 @@ class SBRL(Classifier):
             return a np.ndarray of shape [n_rules, n_instances] of type bool,
             representing whether an instance has
         """
-        un_satisfied = np.ones([x.shape[0]], dtype=np.bool)
-        paths = np.zeros((self.n_rules, x.shape[0]), dtype=np.bool)
-        for i, rule in enumerate(self._rule_list):
-            paths[i, :] = un_satisfied
-            satisfied = rule.is_satisfy(x)
-            # marking new satisfied instances as satisfied
-            un_satisfied = np.logical_and(np.logical_not(satisfied), un_satisfied)
+        winner = self._assign_rule(x)
+        # an instance reaches every rule up to the first one it satisfies
+        # (the unmatched instances, marked by n_rules, reach all the rules)
+        paths = np.arange(self.n_rules)[:, None] <= winner
         return paths
 
-    def _predict_prob(self, x):
+    def _predict_prob(self, x, out=None):
         """
 
         :param x: an instance of pandas.DataFrame object, representing the data to be making predictions on.
+        :param out: an optional float32 array of shape `(n_instances, n_classes)` to write the probabilities into,
+            so that callers predicting repeatedly can reuse it
         :return: `prob` if `rt_support` is `False`, `(prob, supports)` if `rt_support` is `True`.
-            `prob` is a 2D array with shape `(n_instances, n_classes)`.
+            `prob` is a 2D float32 array with shape `(n_instances, n_classes)`.
             `supports` is a list of (n_classes,) 1D arrays denoting the support.
         """
         _x = x
 
-        n_classes = self._rule_probs.shape[1]
-        y = np.empty((_x.shape[0], n_classes), dtype=np.double)
-        un_satisfied = np.ones([_x.shape[0]], dtype=bool)
-        for rule in self._rule_list:
-            is_satisfied = rule.is_satisfy(_x)
-            satisfied = np.logical_and(is_satisfied, un_satisfied)
-            y[satisfied] = rule.output
-            # marking new satisfied instances as satisfied
-            un_satisfied = np.logical_xor(satisfied, un_satisfied)
+        winner = self._assign_rule(_x)
+        # a single gather, the instances that satisfy no rule get the trailing all-zero row
+        y = np.take(self._rule_outputs, winner, axis=0, out=out)
         return y
 
-    def predict_prob(self, x, **kwargs):
-        return self._predict_prob(x)
+    def predict_prob(self, x, out=None, **kwargs):
+        return self._predict_prob(x, out=out)
+
+    def batch_predict_prob(self, xs: List[np.ndarray], **kwargs) -> List[np.ndarray]:
+        """
+        Predict the probabilities of a list of query arrays in a single pass,
+        so that many small queries share the per-call overhead of the rule evaluation.
+        :param xs: a list of 2D arrays with the same number of features
+        :return: a list of the predicted probabilities, one `(n_instances, n_classes)` array per array in xs
+        """
+        if len(xs) == 0:
+            return []
+        sizes = [len(x) for x in xs]
+        y = self._predict_prob(np.concatenate(xs))
+        return np.split(y, np.cumsum(sizes)[:-1])
 
     def _predict(self, x):
-        y_prob = self._predict_prob(x)
-        # print(y_prob[:50])
-        y_pred = np.argmax(y_prob, axis=1)
+        winner = self._assign_rule(x)
+        # Every output row is a known rule output, so the argmax is looked up instead of computed per instance
+        y_pred = self._rule_labels[winner]
         return y_pred
 
     def predict(self, x, **kwargs):
@@ -404,43 +885,75 @@ class RuleList(PreProcessMixin, SBRL):
             rule.categories = categories
 
             # rule.feature_indices
+        self._compile_rules()
 
     def compute_support(self, x, y, transform=False) -> np.ndarray:
         if transform:
-            x, y = self.transform(x, y)
+            # The discretizer leaves y unchanged, so x can share the transformation cache of the predictions
+            x = self._transform_x(x)
         return super(RuleList, self).compute_support(x, y)
 
+    def batch_predict_prob(self, xs: List[np.ndarray], transform=True, **kwargs) -> List[np.ndarray]:
+        if not transform or len(xs) == 0:
+            return super(RuleList, self).batch_predict_prob(xs)
+        # transform the concatenated queries with a single call
+        sizes = [len(x) for x in xs]
+        y = self._predict_prob(self.transform(np.concatenate(xs)))
+        return np.split(y, np.cumsum(sizes)[:-1])
+
+    def compute_confusion_support(self, x, y, y_target, transform=False) -> np.ndarray:
+        if transform:
+            x = self._transform_x(x)
+        return super(RuleList, self).compute_confusion_support(x, y, y_target)
+
     def decision_support(self, x, per_condition=False, transform=False):
         if transform:
-            x = self.transform(x)
+            x = self._transform_x(x)
         return super(RuleList, self).decision_support(x, per_condition)
 
     def decision_path(self, x, transform=False):
         if transform:
-            x = self.transform(x)
+            x = self._transform_x(x)
         return super(RuleList, self).decision_path(x)
 
+    def category_intervals(self) -> List[List[Optional[list]]]:
+        """
+        Compute the intervals of the conditions of all the rules.
+        The conditions are grouped by feature so that discretizer.cat2intervals is called once per feature.
+        :return: a list of n_rules lists, each holding the interval of every condition of the rule
+            (None for the conditions on categorical features)
+        """
+        intervals = [[None] * len(rule.feature_indices) for rule in self._rule_list]
+        continuous_features = set(np.asarray(self.discretizer.continuous_features).tolist())
+        positions = defaultdict(list)  # feature index -> [(rule index, condition index), ...]
+        for i, rule in enumerate(self._rule_list):
+            for j, idx in enumerate(rule.feature_indices):
+                if idx in continuous_features:
+                    positions[idx].append((i, j))
+        for idx, feature_positions in positions.items():
+            cats = np.array([self._rule_list[i].categories[j] for i, j in feature_positions])
+            for (i, j), interval in zip(feature_positions, self.discretizer.cat2intervals(cats, idx)):
+                intervals[i][j] = interval
+        return intervals
+
     def describe(self, feature_names=None, rt_str=False):
         s = "The rule list has {} of rules:\n\n     ".format(self.n_rules)
 
         # n_rules = len(self._rule_indices)
         # feature_names = feature_names if feature_names is not None else self._feature_names
 
+        all_intervals = None
+        if self.discretizer is not None:
+            all_intervals = self.category_intervals()
+        # Collect the pieces and join them once instead of growing the string rule by rule
+        parts = [s]
         for i, rule in enumerate(self._rule_list):
-            category_intervals = None
+            category_intervals = None if all_intervals is None else all_intervals[i]
             is_last = rule.is_default()
-            if self.discretizer is not None:
-                category_intervals = []
-                if not is_last:
-                    for idx, cat in zip(rule.feature_indices, rule.categories):
-                        if idx not in self.discretizer.continuous_features:
-                            interval = None
-                        else:
-                            interval = self.discretizer.cat2intervals(np.array([cat]), idx)[0]
-                        category_intervals.append(interval)
-            s += rule.describe(feature_names, category_intervals, label="prob") + "\n"
+            parts.append(rule.describe(feature_names, category_intervals, label="prob") + "\n")
             if len(self._rule_list) > 1 and not is_last:
-                s += "\nELSE "
+                parts.append("\nELSE ")
+        s = "".join(parts)
 
         if rt_str:
             return s
@@ -2,6 +2,7 @@ from typing import Union, List, Tuple
 from functools import lru_cache
 
 import numpy as np
+from scipy.sparse import csr_matrix
 from sklearn.metrics import confusion_matrix
 from flask import jsonify
 
@@ -76,19 +77,20 @@ def compute_support(model: ModelBase, x: np.ndarray, y: np.ndarray):
 
 def compute_support_matrix(model: ModelBase, x: np.ndarray, y: np.ndarray) -> np.ndarray:
     if isinstance(model, SurrogateMixin) and (isinstance(model, RuleList) or isinstance(model, Tree)):
-        # n_rules x n_instances
-        decision_supports = model.decision_support(x, transform=True)
         n_classes = model.n_classes
-        matrices = np.empty((len(decision_supports), n_classes, n_classes), dtype=np.float)
         y_target = model.target.predict(x)
-        for i, decision_support in enumerate(decision_supports):
-            _y = y[decision_support]
-            _y_target = y_target[decision_support]
-            if len(_y):
-                mat = confusion_matrix(_y, _y_target, list(range(n_classes)))
-            else:
-                mat = np.zeros((n_classes, n_classes), dtype=np.float)
-            matrices[i, :, :] = mat
+        if isinstance(model, RuleList):
+            return model.compute_confusion_support(x, y, y_target, transform=True).astype(np.float)
+        # n_nodes x n_instances
+        decision_supports = model.decision_support(x, transform=True)
+        # One-hot encode the (label, target label) pair of each instance as a sparse matrix,
+        # so that all the confusion matrices are counted with a single sparse product with the supports
+        y, y_target = np.asarray(y, dtype=np.int), np.asarray(y_target, dtype=np.int)
+        valid = np.flatnonzero((0 <= y) & (y < n_classes) & (0 <= y_target) & (y_target < n_classes))
+        pairs = csr_matrix((np.ones(len(valid)), (valid, y[valid] * n_classes + y_target[valid])),
+                           shape=(len(y), n_classes * n_classes))
+        matrices = csr_matrix(decision_supports, dtype=np.float).dot(pairs).toarray()
+        matrices = matrices.reshape(-1, n_classes, n_classes)
         return matrices
     else:
         raise ValueError("Cannot calculate support for model {} of type {}".format(model, model.type))
@@ -1,6 +1,6 @@
 from math import inf
 from typing import List
-from functools import lru_cache, reduce
+from functools import lru_cache
 
 import numpy as np
 # import flask
@@ -250,7 +250,8 @@ def filter_data(is_categorical, x, y, query=None):
         return x, y
 
     assert len(x) == len(y)
-    satisfied = []
+    # Narrow down a single mask in place instead of keeping one temporary mask per filter
+    selected = np.ones((len(y),), dtype=np.bool)
     for i, _filter in enumerate(query):
         if _filter is None:
             continue
@@ -263,14 +264,13 @@ def filter_data(is_categorical, x, y, query=None):
             category = is_categorical[i]
 
         if category:
-            sats = [col == c for c in _filter]
-            satisfied += [reduce(np.logical_or, sats)]
+            selected &= np.isin(col, _filter)
         else:
             low = _filter[0] if _filter[0] is not None else -inf
             high = _filter[1] if _filter[1] is not None else inf
-            satisfied += [np.logical_and(low < col, col < high)]
+            selected &= low < col
+            selected &= col < high
 
-    selected = reduce(np.logical_and, satisfied, np.ones((len(y),), dtype=np.bool))
     return x[selected], y[selected]
 
 